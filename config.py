@@ -6,14 +6,33 @@ import urllib3
 class APIConfig:
     DEFAULT_PARAMS: str = "current=temperature_2m,wind_speed_10m&temperature_unit=fahrenheit&wind_speed_unit=mph&timezone=auto"
     GEOCODE_BASE_URL: str = "https://geocode.maps.co/search"
-    HTTP_CONFIG = {
+    # Shared by both HTTP client modes below, which only differ in their retry policy
+    HTTP_CONFIG_BASE = {
         'timeout': urllib3.Timeout(connect=2.0, read=5.0),
+        'maxsize': 10,
+        'cert_reqs': 'CERT_REQUIRED'
+    }
+    # Long-running / batch use: retry transient failures with backoff
+    HTTP_CONFIG_BATCH = {
+        **HTTP_CONFIG_BASE,
         'retries': urllib3.Retry(
             total=3,
             backoff_factor=0.3,
             status_forcelist=[500, 502, 503, 504]
-        ),
-        'maxsize': 10,
-        'cert_reqs': 'CERT_REQUIRED'
+        )
+    }
+    # Single-shot CLI use: fail fast on any error, and let the caller decide what to do.
+    # Redirects are still followed (retries=False would disable those too), and errors still
+    # arrive as MaxRetryError
+    HTTP_CONFIG_ONESHOT = {
+        **HTTP_CONFIG_BASE,
+        'retries': urllib3.Retry(
+            total=None,
+            connect=0,
+            read=0,
+            status=0,
+            other=0,
+            redirect=3
+        )
     }
     WEATHER_BASE_URL: str = "https://api.open-meteo.com/v1/forecast"
@@ -2,75 +2,142 @@
 ## An example python app that illustrates a number of standard python patterns.
 
 import argparse
+import atexit
+import copy
 from dataclasses import dataclass
+from functools import lru_cache
 import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import os
+import queue
+import re
+import socket
 import sys
+import threading
+from urllib.parse import quote_plus
 import urllib3
-import usaddress
 from config import APIConfig
 
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
 MAPS_API_KEY = os.environ.get('MAPS_API_KEY')
 
+# Matches already well-formed input, e.g. "123 Main St, Springfield, IL 62701"
+_CLEAN_ADDRESS = re.compile(r'^\s*\d+\s+[A-Za-z0-9 .\-]+,\s*[A-Za-z .\-]+,\s*[A-Z]{2}\s+\d{5}(?:-\d{4})?\s*$')
+# Matches "City, ST" input, e.g. "Springfield, IL"
+_CITY_STATE = re.compile(r'^[A-Za-z .\-]+,\s*[A-Z]{2}$')
+
+# Geocode API URL, with everything but the address filled in up front
+_GEOCODE_URL_TEMPLATE = f"{APIConfig.GEOCODE_BASE_URL}?q={{address}}&api_key={MAPS_API_KEY}"
+
+# Weather API URL, with everything but the coordinates filled in up front
+_WEATHER_URL_TEMPLATE = f"{APIConfig.WEATHER_BASE_URL}?latitude={{latitude}}&longitude={{longitude}}&{APIConfig.DEFAULT_PARAMS}"
+
 def build_url(latitude: float, longitude: float, verbose: bool=False) -> str:
     try:
         latitude = float(latitude)
         longitude = float(longitude)
-    except:
+    # float() raises TypeError for None, so missing values are also caught here
+    except (TypeError, ValueError):
         raise BuildUrlError(
             f"Lat/long must be numerical values. Received: Latitude: {latitude}, Longitude: {longitude}"
         )
-    
-    if latitude is None or longitude is None:
-        raise BuildUrlError(
-            f"Latitude and/or longitude not provided. Latitude: {latitude}, Longitude: {longitude}"
-        )
 
     if not validate_latitude_longitude(latitude, longitude):
         raise BuildUrlError(f"Invalid lat/long provided. Latitude: {latitude}, Longitude: {longitude}")
 
-    url = f"{APIConfig.WEATHER_BASE_URL}?latitude={latitude}&longitude={longitude}&{APIConfig.DEFAULT_PARAMS}"
-    return url
+    return _WEATHER_URL_TEMPLATE.format(latitude=latitude, longitude=longitude)
 
-def create_http_client():
-    return urllib3.PoolManager(**APIConfig.HTTP_CONFIG)
+def create_http_client(mode: str='oneshot') -> urllib3.PoolManager:
+    """
+    Creates an HTTP client. 'oneshot' (the CLI default) disables retries; 'batch' retries
+    transient failures with backoff.
+    """
+    if mode == 'oneshot':
+        return urllib3.PoolManager(**APIConfig.HTTP_CONFIG_ONESHOT)
+    if mode == 'batch':
+        return urllib3.PoolManager(**APIConfig.HTTP_CONFIG_BATCH)
+    raise ValueError(f"Unknown HTTP client mode: {mode}")
+
+def _warm_connections(http: urllib3.PoolManager, urls: list[str], resolve_urls: list[str]) -> None:
+    """
+    Opens keep-alive connections (DNS + TCP + TLS) to the hosts of urls, and only resolves
+    the hosts of resolve_urls (DNS), without sending them a request.
+    Meant to run in a background thread, ahead of the first real request.
+    """
+    # Best effort only: the real requests will surface any errors
+    for url in resolve_urls:
+        parsed = urllib3.util.parse_url(url)
+        try:
+            socket.getaddrinfo(parsed.host, parsed.port or (443 if parsed.scheme == 'https' else 80))
+        except OSError:
+            pass
+
+    for url in urls:
+        # Keep the scheme, host and port, so the connection lands in the same pool as the real request
+        root_url = urllib3.util.parse_url(url)._replace(path='/', query=None, fragment=None).url
+        try:
+            http.request('HEAD', root_url, retries=False)
+        except urllib3.exceptions.HTTPError:
+            pass
 
-def display_weather_data(response: str) -> None:
+def display_weather_data(response: bytes) -> None:
     """
     Parses and displays weather data from API response.
     Args:
-        response: JSON response string from weather API
+        response: Raw JSON response body from weather API
     """
     try:
         data = parse_json_response(response)
-        weather_data = WeatherData.from_dict(data)
 
-        temperature = weather_data.current.get('temperature_2m')
-        wind_speed = weather_data.current.get('wind_speed_10m')
-        print(f"Temperature:\t{temperature}°\nWind Speed:\t{wind_speed} MPH")
+        # Only the 'current' block is displayed, so there's no need to build a full WeatherData
+        current = data.get('current') if isinstance(data, dict) else None
+        if not current:
+            raise ValueError("Missing 'current' field in weather data")
+
+        temperature = current.get('temperature_2m')
+        wind_speed = current.get('wind_speed_10m')
+        # Written as a single pre-composed string, in one write() call. This goes through
+        # sys.stdout itself (not .buffer), so it honors its encoding, and works if it's been replaced
+        sys.stdout.write(f"Temperature:\t{temperature}°\nWind Speed:\t{wind_speed} MPH\n")
     except ValueError as e:
         logging.error(f"Failed to parse weather data: {e}")
 
+@lru_cache(maxsize=512)
+def _geocode(address: str) -> tuple[dict, ...]:
+    """
+    Fetches and parses geocoding results for an address.
+    Results are cached, so repeated lookups of the same address skip the network round trip.
+    """
+    response = WEATHER_API.fetch_url(_GEOCODE_URL_TEMPLATE.format(address=quote_plus(address)))
+    return tuple(parse_json_response(response))
+
 def get_coords_from_address(address: str, verbose: bool=False) -> list[dict]:
     try:  
-        url = f"{APIConfig.GEOCODE_BASE_URL}?q={address}&api_key={MAPS_API_KEY}"
-        with WeatherAPI.get_instance() as weather_api:
-            response = weather_api.fetch_url(url, verbose)
-        coords = parse_json_response(response)
+        if verbose:
+            logging.info(f"Looking up coordinates from: {_GEOCODE_URL_TEMPLATE.format(address=quote_plus(address))} \n")
+
+        # Deep copy, as the cached result dicts would otherwise be shared with (and modifiable by) the caller
+        coords = copy.deepcopy(list(_geocode(address)))
 
         if not coords:
             raise GetCoordsFromAddressError(
                 f"No coordinates found for address: {address}. Verify that the address is valid."
             ) 
 
-        if verbose:
+        # Skip building / serializing the location data if the INFO record would be discarded anyway
+        if verbose and logging.getLogger().isEnabledFor(logging.INFO):
+            first = coords[0]
             location_data = {
-                'display_name': coords[0]['display_name'],
-                'lat': coords[0]['lat'],
-                'long': coords[0]['lon']
+                'display_name': first['display_name'],
+                'lat': first['lat'],
+                'long': first['lon']
             }
-            logging.info(f"Location data:\n{json.dumps(location_data, indent=2, sort_keys=True)}\n")
+            logging.info("Location data:\n%s\n", json.dumps(location_data, indent=2, sort_keys=True))
         
         return coords
 
@@ -99,18 +166,24 @@ def get_weather_url(parsed_args) -> str:
     
     raise ParsedArgumentError("Failed to build URL: No valid address / coordinates provided.")
 
+def _build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Fetch weather data.")
+    parser.add_argument('--address', type=str, required=False, help='Address of the location')
+    parser.add_argument('--latitude', type=float, required=False, help='Latitude of the location')
+    parser.add_argument('--longitude', type=float, required=False, help='Longitude of the location')
+    parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
+    return parser
+
+# Built once, and reused by every call to parse_args()
+_ARG_PARSER = _build_arg_parser()
+
 def parse_args(args: list[str]) -> argparse.Namespace:
     """
     Parses command line arguments.
     Raises ParsedArgumentError if validation fails.
     """
 
-    parser = argparse.ArgumentParser(description="Fetch weather data.")
-    parser.add_argument('--address', type=str, required=False, help='Address of the location')
-    parser.add_argument('--latitude', type=float, required=False, help='Latitude of the location')
-    parser.add_argument('--longitude', type=float, required=False, help='Longitude of the location')
-    parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
-    parsed_args = parser.parse_args(args)
+    parsed_args = _ARG_PARSER.parse_args(args)
 
     # Test to ensure that either:
     # 1. latitude and longitude are both provided
@@ -138,68 +211,100 @@ def parse_args(args: list[str]) -> argparse.Namespace:
 
     return parsed_args
 
-def parse_json_response(response: str) -> dict:
+def parse_json_response(response: bytes) -> dict:
+    """
+    Parses a raw JSON response body. Takes bytes, so the body never needs decoding to str first.
+    Raises ValueError if the JSON is malformed.
+    """
     try:
-        return json.loads(response)
-    except json.JSONDecodeError as e:
+        return _loads(response)
+    # orjson.JSONDecodeError and json.JSONDecodeError both subclass ValueError
+    except ValueError as e:
         raise ValueError(f"Malformed JSON response: {e}")
 
 def sanitize_address(address: str, verbose: bool=False) -> str:
     if not address or not address.strip():
         raise ValueError(f"Missing address. Input provided: {address}")
     
-    try:
-        if usaddress.parse(address) is not None:
+    stripped = address.strip()
+
+    # A bare ZIP code, "City, ST", or a well-formed full address doesn't need to go
+    # through the (much slower) usaddress tagger
+    if (
+        (len(stripped) == 5 and stripped.isascii() and stripped.isdigit())
+        or _CITY_STATE.match(stripped)
+        or _CLEAN_ADDRESS.match(stripped)
+    ):
+        # Collapse runs of whitespace, and use ", " between parts, to match the usaddress output
+        sanitized = ', '.join(' '.join(part.split()) for part in stripped.split(','))
+    else:
+        # Imported here, as loading the usaddress model is slow, and it isn't needed for lat/long input
+        import usaddress
+
+        try:
             parsed_components = usaddress.parse(address)
+            if not parsed_components:
+                raise AddressMissingError(f"Missing address from 'usaddress'. Input provided: {address}")
+
             sanitized = ' '.join(component for component, label in parsed_components)
-        else:
-            raise AddressMissingError(f"Missing address from 'usaddress'. Input provided: {address}")
 
-        if verbose:
-            logging.info(f"Sanitized address: {sanitized}\n")
+        except usaddress.RepeatedLabelError as e :
+            raise ParseAddressError(f"Error parsing address: {e.parsed_string}, {e.original_string}")
 
-        return sanitized
+    if verbose:
+        logging.info(f"Sanitized address: {sanitized}\n")
 
-    except usaddress.RepeatedLabelError as e :
-        raise ParseAddressError(f"Error parsing address: {e.parsed_string}, {e.original_string}")
+    return sanitized
 
 def setup_logging(verbose: bool=False) -> None:
+    # basicConfig() is a no-op once the root logger has handlers, so don't start another listener either
+    if logging.getLogger().handlers:
+        return
+
     level = logging.DEBUG if verbose else logging.INFO
+
+    # File writes are handed off to a queue, and done by a background thread. stdout stays
+    # synchronous, so log lines stay in order with the weather report printed on the main thread
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, logging.FileHandler('weather_app.log'))
+    listener.start()
+    atexit.register(listener.stop)
+
     logging.basicConfig(
         level=level,
         format='%(levelname)s: %(message)s',
         handlers=[
             logging.StreamHandler(sys.stdout),
-            logging.FileHandler('weather_app.log')
+            QueueHandler(log_queue)
         ]
     )
 
 def validate_latitude_longitude(latitude: float, longitude: float) -> bool:
     """Validates latitude and longitude values."""
 
-    if not (-90 <= latitude <= 90):
-        return False
-
-    if not (-180 <= longitude <= 180):
-        return False
-
-    return True
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180
 
 @dataclass
 class WeatherData:
+    # Declared by hand, as dataclass(slots=True) needs Python 3.10+ (the Docker image uses 3.9)
+    __slots__ = ('latitude', 'longitude', 'current')
+
     latitude: float
     longitude: float
     current: dict
 
     @classmethod
     def from_dict(cls, data: dict) -> 'WeatherData':
-        if not all(key in data for key in ['latitude', 'longitude', 'current']):
-            raise ValueError("Missing required fields in weather data")
-        return cls(
-            latitude=float(data['latitude']),
-            longitude=float(data['longitude']),
-            current=data['current']
-        )
+        if not isinstance(data, dict):
+            raise ValueError(f"Weather data must be a JSON object, got: {type(data).__name__}")
+        try:
+            return cls(
+                latitude=float(data['latitude']),
+                longitude=float(data['longitude']),
+                current=data['current']
+            )
+        except KeyError as e:
+            raise ValueError(f"Missing required field in weather data: {e.args[0]}")
 
     def __str__(self) -> str:
         return (f"WeatherData(latitude={self.latitude}, longitude={self.longitude}, "
@@ -207,27 +312,14 @@ class WeatherData:
                 f"wind_speed={self.current.get('wind_speed_10m')})")
 
 class WeatherAPI:
-    _instance = None
-    
-    @classmethod
-    def get_instance(cls):
-        if cls._instance is None:
-            cls._instance = cls()
-        return cls._instance
-
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance.http = create_http_client()
-        return cls._instance
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.http.clear()
-
-    def fetch_url(self, url: str, verbose: bool=False) -> str:
+    def __init__(self, mode: str='oneshot'):
+        self.http = create_http_client(mode)
+
+    def fetch_url(self, url: str, verbose: bool=False) -> bytes:
+        """
+        Fetches a URL, and returns the raw (undecoded) response body.
+        Raises FetchUrlDataError if the request fails.
+        """
         if verbose:
             logging.info(f"Fetching data from: {url} \n")
         
@@ -235,12 +327,16 @@ class WeatherAPI:
             response = self.http.request('GET', url)
             if response.status != 200:
                 raise FetchUrlDataError(f"Failed to fetch data: {response.status}")
-            return response.data.decode('utf-8')
+            return response.data
         except urllib3.exceptions.TimeoutError:
             raise FetchUrlDataError("Request timed out")
         except urllib3.exceptions.RequestError as e:
             raise FetchUrlDataError(f"Request failed: {str(e)}")
 
+# Shared by all requests, so pooled keep-alive connections get reused; closed once, on exit
+WEATHER_API = WeatherAPI()
+atexit.register(WEATHER_API.http.clear)
+
 # Exception handlers
 class BuildUrlError(Exception):
     """
@@ -285,10 +381,19 @@ def main() -> None:
     parsed_args = parse_args(sys.argv[1:])
     setup_logging(parsed_args.verbose)
 
+    if parsed_args.address:
+        # The weather host is only reached after the geocode round trip, so connect to it in the
+        # meantime. The (rate-limited) geocode host only has its DNS resolved, as its request
+        # goes out soon anyway, and a warm-up request would be an extra hit on the API.
+        threading.Thread(
+            target=_warm_connections,
+            args=(WEATHER_API.http, [APIConfig.WEATHER_BASE_URL], [APIConfig.GEOCODE_BASE_URL]),
+            daemon=True
+        ).start()
+
     url = get_weather_url(parsed_args)
 
-    with WeatherAPI.get_instance() as weather_api:
-        response = weather_api.fetch_url(url, parsed_args.verbose)
+    response = WEATHER_API.fetch_url(url, parsed_args.verbose)
 
     # Print weather data
     display_weather_data(response)